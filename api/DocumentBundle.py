@@ -0,0 +1,85 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+class DocumentBundle:
+    """Accumulates small documents to be upserted in a single request"""
+
+    def __init__(
+        self,
+        max_bytes: int = 262144,
+        max_documents: int = 100,
+        max_document_bytes: int = 4096,
+    ):
+        """
+        Args:
+            max_bytes: Maximum size in bytes of the base64-encoded bundle as sent
+                       in the request body, the surrounding loader configuration
+                       adds a few hundred bytes on top
+            max_documents: Maximum number of documents in the bundle
+            max_document_bytes: Largest serialized document (JSON line, before
+                                encoding) that counts as small enough to bundle
+        """
+        self.max_bytes = max_bytes
+        self.max_documents = max_documents
+        self.max_document_bytes = max_document_bytes
+        self.documents: List[Tuple[Path, str, Dict]] = []
+        self.size = 0
+
+    @staticmethod
+    def serialize_document(content: str, metadata: Dict) -> str:
+        """Serialize one document as a JSON line"""
+        return json.dumps(
+            {"pageContent": content, "metadata": metadata},
+            ensure_ascii=False,
+            default=str,
+        )
+
+    @classmethod
+    def to_jsonlines(cls, documents: List[Tuple[Path, str, Dict]]) -> str:
+        """Serialize documents as JSON lines"""
+        return "\n".join(
+            cls.serialize_document(content, metadata)
+            for _, content, metadata in documents
+        )
+
+    def document_size(self, content: str, metadata: Dict) -> int:
+        """Size in bytes the document takes in the bundle before encoding"""
+        return len(self.serialize_document(content, metadata).encode("utf-8")) + 1
+
+    @staticmethod
+    def encoded_size(size: int) -> int:
+        """Size in bytes of the base64 encoding of size bytes"""
+        return 4 * ((size + 2) // 3)
+
+    def can_bundle(self, content: str, metadata: Dict) -> bool:
+        """Check if the document is small enough to be bundled at all"""
+        size = self.document_size(content, metadata)
+        return (
+            size <= self.max_document_bytes
+            and self.encoded_size(size) <= self.max_bytes
+        )
+
+    def fits(self, content: str, metadata: Dict) -> bool:
+        """Check if the document fits in the remaining space of the bundle"""
+        size = self.size + self.document_size(content, metadata)
+        return (
+            len(self.documents) < self.max_documents
+            and self.encoded_size(size) <= self.max_bytes
+        )
+
+    def add(self, file_path: Path, content: str, metadata: Dict):
+        """Add a document to the bundle"""
+        self.documents.append((file_path, content, metadata))
+        self.size += self.document_size(content, metadata)
+
+    def drain(self) -> List[Tuple[Path, str, Dict]]:
+        """Return the bundled documents and empty the bundle"""
+        documents = self.documents
+        self.documents = []
+        self.size = 0
+        return documents
+
+    def __len__(self) -> int:
+        return len(self.documents)
@@ -1,14 +1,21 @@
 import os
 import json
+import base64
+import hashlib
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple, Union
 import requests
 import logging
+from .DocumentBundle import DocumentBundle
+from .LoaderIdCache import LoaderIdCache
 
 
 class FlowiseUpserter:
     """Handles document upserting to Flowise API"""
 
+    # Bundle errors that a specific document can cause
+    BUNDLE_SPLIT_STATUS_CODES = {400, 413, 422}
+
     def __init__(self):
         self.base_url = os.getenv("FLOWISE_API_URL")
         self.api_key = os.getenv("FLOWISE_API_KEY")
@@ -38,7 +45,122 @@ class FlowiseUpserter:
             "Content-Type": "application/json",
         }
 
+        # Mapping from doc_id/path to the Flowise loader holding the document
+        self.loader_ids = LoaderIdCache(
+            os.getenv("DOC_ID_CACHE_FILE", "doc_id_cache.json"),
+            int(os.getenv("DOC_ID_CACHE_SAVE_INTERVAL", "50")),
+        )
+        # Keys resolved during this run, by file path and by doc_id owner
+        self.document_keys: Dict[str, str] = {}
+        self.doc_id_paths: Dict[str, str] = {}
+
+    def document_key(self, file_path: Path, metadata: Dict) -> str:
+        """Key identifying a document across runs: its doc_id, else its path
+
+        A doc_id already used by another file falls back to the path, so two
+        files sharing a doc_id never replace each other's loader.
+        """
+        path = str(file_path.absolute())
+        key = self.document_keys.get(path)
+        if key is not None:
+            return key
+
+        key = metadata.get("doc_id") or path
+        if key != path:
+            owner = self.doc_id_paths.setdefault(key, path)
+            entry = self.loader_ids.get(key)
+            cached_owner = entry.get("path") if entry else None
+            if owner != path:
+                logging.warning(
+                    f"doc_id {key} of {path} is already used by {owner}, keying by path"
+                )
+                key = path
+            elif cached_owner and cached_owner != path and Path(cached_owner).exists():
+                logging.warning(
+                    f"doc_id {key} of {path} is already used by {cached_owner}, "
+                    f"keying by path"
+                )
+                self.doc_id_paths[key] = cached_owner
+                key = path
+
+        self.document_keys[path] = key
+        return key
+
+    @staticmethod
+    def content_hash(content: str, metadata: Dict) -> str:
+        """Hash of what an upsert sends for the document"""
+        payload = json.dumps(
+            {"content": content, "metadata": metadata}, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_loader_entry(self, file_path: Path, metadata: Dict) -> Optional[Dict]:
+        """Cached loader entry of the document, if it was upserted before"""
+        return self.loader_ids.get(self.document_key(file_path, metadata))
+
+    def is_unchanged(self, file_path: Path, content: str, metadata: Dict) -> bool:
+        """Check if the document is already in the store with this content"""
+        entry = self.get_loader_entry(file_path, metadata)
+        return bool(entry) and entry.get("hash") == self.content_hash(
+            content, metadata
+        )
+
+    def bundle_members(self, loader_id: str) -> List[Tuple[str, Path]]:
+        """Keys and paths of the documents stored in a bundle loader"""
+        return [
+            (key, Path(path))
+            for key, path in self.loader_ids.bundle_members(loader_id)
+            if path
+        ]
+
+    def forget_document(self, key: str):
+        """Drop a document from the loader ID mapping"""
+        self.loader_ids.remove(key)
+
+    def save_loader_ids(self):
+        """Persist the doc_id to loader ID mapping"""
+        self.loader_ids.save()
+
     def upsert_document(self, file_path: Path, content: str, metadata: Dict) -> Dict:
+        """Upsert a document, replacing its existing loader when one is known"""
+        key = self.document_key(file_path, metadata)
+        entry = self.loader_ids.get(key)
+        loader_id = None
+        if entry and entry.get("bundled"):
+            # A bundle loader is shared, replacing it would drop other documents
+            logging.info(f"{file_path} moves out of bundle loader {entry['loader_id']}")
+        elif entry:
+            loader_id = entry["loader_id"]
+
+        try:
+            result = self._upsert_plain_text(content, metadata, loader_id)
+        except requests.HTTPError as e:
+            if (
+                loader_id is None
+                or e.response is None
+                or e.response.status_code != 404
+            ):
+                raise
+            logging.warning(
+                f"Loader {loader_id} for {file_path} no longer exists, creating a new one"
+            )
+            self.loader_ids.remove(key)
+            result = self._upsert_plain_text(content, metadata, None)
+
+        new_loader_id = result.get("docId") if isinstance(result, dict) else None
+        if new_loader_id:
+            self.loader_ids.set(
+                key,
+                new_loader_id,
+                str(file_path.absolute()),
+                self.content_hash(content, metadata),
+            )
+
+        return result
+
+    def _upsert_plain_text(
+        self, content: str, metadata: Dict, loader_id: Optional[str] = None
+    ) -> Dict:
         try:
             # Use upsert endpoint for both new and existing documents
             url = f"{self.base_url}/document-store/upsert/{self.document_store_id}"
@@ -55,6 +177,11 @@ class FlowiseUpserter:
                 "metadata": metadata,
             }
 
+            # Replace the existing loader in place instead of adding a new one
+            if loader_id:
+                config["docId"] = loader_id
+                config["replaceExisting"] = True
+
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json",
@@ -77,6 +204,199 @@ class FlowiseUpserter:
                 logging.error(f"Response content: {e.response.text}")
             raise
 
+    def upsert_bundle(
+        self, documents: List[Tuple[Path, str, Dict]], loader_id: Optional[str] = None
+    ) -> Dict[Path, Union[Dict, Exception]]:
+        """Upsert several documents in one request using the JSON lines loader
+
+        When Flowise rejects the bundle content it is split in halves and
+        retried, so only the documents responsible end up reported as failed.
+        Transport, auth and server errors fail the whole bundle at once.
+
+        With loader_id the existing bundle loader is replaced in place with
+        the given documents, which must be all of its members. A replacement
+        is never split since the halves would end up in new loaders.
+        """
+        if not documents:
+            return {}
+        if loader_id:
+            try:
+                result = self._post_bundle(documents, loader_id)
+            except requests.RequestException as e:
+                if e.response is None or e.response.status_code != 404:
+                    logging.error(
+                        f"Replacing bundle loader {loader_id} failed: {e}"
+                    )
+                    return {file_path: e for file_path, _, _ in documents}
+                logging.warning(
+                    f"Bundle loader {loader_id} no longer exists, creating a new one"
+                )
+                return self.upsert_bundle(documents)
+            return {file_path: result for file_path, _, _ in documents}
+        if len(documents) == 1:
+            file_path, content, metadata = documents[0]
+            try:
+                return {file_path: self.upsert_document(file_path, content, metadata)}
+            except Exception as e:
+                return {file_path: e}
+
+        try:
+            result = self._post_bundle(documents)
+            return {file_path: result for file_path, _, _ in documents}
+        except requests.RequestException as e:
+            if not self._is_document_error(e):
+                logging.error(f"Bundle of {len(documents)} documents failed: {e}")
+                return {file_path: e for file_path, _, _ in documents}
+            return self._split_bundle(documents, e)
+
+    def _is_document_error(self, error: requests.RequestException) -> bool:
+        """Check if a bundle error may come from specific documents"""
+        return (
+            error.response is not None
+            and error.response.status_code in self.BUNDLE_SPLIT_STATUS_CODES
+        )
+
+    def _split_bundle(
+        self, documents: List[Tuple[Path, str, Dict]], error: Exception
+    ) -> Dict[Path, Union[Dict, Exception]]:
+        """Retry a rejected bundle in halves to find the failing documents
+
+        When both halves fail with the same error the cause is not in the
+        documents, so the whole bundle fails without splitting further.
+        """
+        logging.warning(
+            f"Bundle of {len(documents)} documents rejected, splitting and retrying"
+        )
+        middle = len(documents) // 2
+        halves = [documents[:middle], documents[middle:]]
+
+        attempts = []
+        for half in halves:
+            try:
+                attempts.append(self._post_bundle(half))
+            except requests.RequestException as e:
+                attempts.append(e)
+
+        first, second = attempts
+        if (
+            isinstance(first, requests.RequestException)
+            and isinstance(second, requests.RequestException)
+            and self._error_signature(first) == self._error_signature(second)
+        ):
+            logging.error(
+                f"Both halves of a bundle of {len(documents)} documents failed "
+                f"with the same error, not splitting further: {first}"
+            )
+            return {file_path: first for file_path, _, _ in documents}
+
+        results = {}
+        for half, attempt in zip(halves, attempts):
+            if not isinstance(attempt, Exception):
+                results.update({file_path: attempt for file_path, _, _ in half})
+            elif len(half) == 1 or not self._is_document_error(attempt):
+                results.update({file_path: attempt for file_path, _, _ in half})
+            else:
+                results.update(self._split_bundle(half, attempt))
+        return results
+
+    @staticmethod
+    def _error_signature(error: requests.RequestException) -> Tuple:
+        """Status code and body identifying an error response"""
+        if error.response is None:
+            return (type(error).__name__, str(error))
+        return (error.response.status_code, error.response.text)
+
+    def _post_bundle(
+        self, documents: List[Tuple[Path, str, Dict]], loader_id: Optional[str] = None
+    ) -> Dict:
+        """Send one bundle upsert request, raising on failure"""
+        try:
+            url = f"{self.base_url}/document-store/upsert/{self.document_store_id}"
+
+            jsonlines = DocumentBundle.to_jsonlines(documents)
+            encoded = base64.b64encode(jsonlines.encode("utf-8")).decode("ascii")
+            metadata_keys = sorted(
+                {key for _, _, metadata in documents for key in metadata}
+            )
+
+            config = {
+                "loader": {
+                    "name": "jsonlinesFile",
+                    "config": {
+                        "jsonlinesFile": f"data:application/jsonl;base64,{encoded},filename:bundle.jsonl",
+                        "pointerName": "pageContent",
+                        "metadata": json.dumps(
+                            {key: f"/metadata/{key}" for key in metadata_keys}
+                        ),
+                    },
+                },
+                "splitter": {"name": "recursiveCharacterTextSplitter", "config": {}},
+                "embedding": {
+                    "name": "openAIEmbeddings",
+                    "config": {"openAIApiKey": os.getenv("OPENAI_API_KEY", "")},
+                },
+                "vectorStore": {"name": "pinecone", "config": {"namespace": "default"}},
+                "recordManager": {"name": "postgresRecordManager", "config": {}},
+            }
+
+            # Replace the existing bundle loader in place instead of adding one
+            if loader_id:
+                config["docId"] = loader_id
+                config["replaceExisting"] = True
+
+            logging.info(
+                f"Upserting bundle of {len(documents)} documents ({len(jsonlines)} chars)"
+            )
+            logging.debug(f"Bundle files: {[str(path) for path, _, _ in documents]}")
+            response = requests.post(url, headers=self.headers, json=config)
+
+            if response.status_code != 200:
+                logging.error(f"Response content: {response.text}")
+            response.raise_for_status()
+
+            result = response.json()
+            logging.info(f"Response result: {json.dumps(result, indent=2)}")
+
+            # Remember bundled documents so their bundle can be rebuilt in place
+            bundle_loader_id = (
+                result.get("docId") if isinstance(result, dict) else None
+            ) or loader_id
+            if bundle_loader_id:
+                for file_path, content, metadata in documents:
+                    self.loader_ids.set(
+                        self.document_key(file_path, metadata),
+                        bundle_loader_id,
+                        str(file_path.absolute()),
+                        self.content_hash(content, metadata),
+                        bundled=True,
+                    )
+
+            return result
+
+        except requests.RequestException as e:
+            if e.response is not None:
+                logging.error(f"Response content: {e.response.text}")
+            raise
+
+    def delete_loader(self, loader_id: str):
+        """Delete a loader and its chunks from the document store"""
+        try:
+            url = (
+                f"{self.base_url}/document-store/loader/"
+                f"{self.document_store_id}/{loader_id}"
+            )
+            logging.info(f"Deleting loader {loader_id}")
+            response = requests.delete(url, headers=self.headers)
+
+            if response.status_code != 200:
+                logging.error(f"Response content: {response.text}")
+            response.raise_for_status()
+
+        except requests.RequestException as e:
+            if e.response is not None:
+                logging.error(f"Response content: {e.response.text}")
+            raise
+
     def _clean_none_values(self, d: Dict) -> Dict:
         """Recursively remove None values from dictionaries"""
         if not isinstance(d, dict):
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+class LoaderIdCache:
+    """Local mapping from document keys to Flowise document store loader IDs
+
+    Each entry records the loader ID, the path of the file it came from, the
+    hash of the content last upserted and whether the loader is a bundle
+    shared with other documents.
+    """
+
+    def __init__(
+        self, cache_file: str = "doc_id_cache.json", save_interval: int = 50
+    ):
+        """
+        Args:
+            cache_file: JSON file the mapping is persisted to
+            save_interval: Save to disk after this many changes (0 disables)
+        """
+        self.cache_file = Path(cache_file)
+        self.save_interval = save_interval
+        self.entries: Dict[str, Dict] = {}
+        self.pending_changes = 0
+        self.load()
+
+    def load(self):
+        """Load the mapping from disk if it exists"""
+        if not self.cache_file.exists():
+            return
+        try:
+            entries = json.loads(self.cache_file.read_text(encoding="utf-8"))
+            if not isinstance(entries, dict):
+                raise ValueError(
+                    f"expected a JSON object, got {type(entries).__name__}"
+                )
+            self.entries = {}
+            for key, entry in entries.items():
+                # Older caches stored only the loader ID
+                if isinstance(entry, str):
+                    entry = {"loader_id": entry, "path": None, "bundled": False}
+                if isinstance(entry, dict) and entry.get("loader_id"):
+                    self.entries[key] = entry
+                else:
+                    logging.warning(f"Ignoring invalid loader ID cache entry {key}")
+            logging.debug(
+                f"Loaded {len(self.entries)} loader IDs from {self.cache_file}"
+            )
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read loader ID cache {self.cache_file}: {e}")
+            self.entries = {}
+
+    def save(self):
+        """Persist the mapping to disk if it changed"""
+        if not self.pending_changes:
+            return
+        # Write a temporary file and swap it in so an interruption never
+        # leaves a truncated cache behind
+        temp_file = self.cache_file.with_name(self.cache_file.name + ".tmp")
+        temp_file.write_text(
+            json.dumps(self.entries, indent=2, sort_keys=True), encoding="utf-8"
+        )
+        os.replace(temp_file, self.cache_file)
+        self.pending_changes = 0
+        logging.debug(f"Saved {len(self.entries)} loader IDs to {self.cache_file}")
+
+    def _mark_changed(self):
+        self.pending_changes += 1
+        if self.save_interval and self.pending_changes >= self.save_interval:
+            self.save()
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self.entries.get(key)
+
+    def set(
+        self,
+        key: str,
+        loader_id: str,
+        path: str,
+        content_hash: Optional[str] = None,
+        bundled: bool = False,
+    ):
+        entry = {
+            "loader_id": loader_id,
+            "path": path,
+            "hash": content_hash,
+            "bundled": bundled,
+        }
+        if self.entries.get(key) != entry:
+            self.entries[key] = entry
+            self._mark_changed()
+
+    def remove(self, key: str):
+        if self.entries.pop(key, None) is not None:
+            self._mark_changed()
+
+    def bundle_members(self, loader_id: str) -> List[Tuple[str, str]]:
+        """Keys and paths of the documents stored in a bundle loader"""
+        return [
+            (key, entry["path"])
+            for key, entry in self.entries.items()
+            if entry.get("bundled") and entry["loader_id"] == loader_id
+        ]
@@ -2,5 +2,7 @@
 
 # This can be empty or simply:
 from .FlowiseApi import FlowiseUpserter
+from .DocumentBundle import DocumentBundle
+from .LoaderIdCache import LoaderIdCache
 
-__all__ = ["FlowiseUpserter"]
+__all__ = ["FlowiseUpserter", "DocumentBundle", "LoaderIdCache"]
@@ -2,10 +2,13 @@ import os
 import sys
 import logging
 from pathlib import Path
+from typing import Dict, Tuple
 from dotenv import load_dotenv
 from watcher.Documents import DocumentFinder
 from data.FrontmatterProcess import FrontmatterProcessor
 from api.FlowiseApi import FlowiseUpserter
+from api.DocumentBundle import DocumentBundle
+from profiling.RunProfiler import RunProfiler
 
 
 def validate_env():
@@ -42,6 +45,126 @@ def setup_logging():
     )
 
 
+def read_document(
+    file_path: Path, frontmatter_processor: FrontmatterProcessor, profiler: RunProfiler
+) -> Tuple[str, Dict]:
+    """Read a file and return its content without frontmatter and its metadata"""
+    # Read file content
+    with profiler.stage("read"):
+        content = file_path.read_text(encoding="utf-8")
+    logging.debug(f"Processing file: {file_path}")
+
+    # Extract and process frontmatter
+    with profiler.stage("frontmatter"):
+        metadata, clean_content = frontmatter_processor.extract_frontmatter(content)
+        processed_metadata = frontmatter_processor.process_metadata(
+            metadata, file_path
+        )
+    return clean_content, processed_metadata
+
+
+def log_results(results: Dict) -> Tuple[int, int]:
+    """Log the outcome of each file and return how many succeeded and failed"""
+    succeeded = failed = 0
+    for file_path, result in results.items():
+        if isinstance(result, Exception):
+            logging.error(f"Error processing {file_path}: {str(result)}")
+            failed += 1
+        else:
+            logging.info(f"Successfully processed {file_path}")
+            logging.debug(f"Upsert result: {result}")
+            succeeded += 1
+    return succeeded, failed
+
+
+def flush_bundle(
+    flowise_upserter: FlowiseUpserter, bundle: DocumentBundle, profiler: RunProfiler
+) -> Tuple[int, int]:
+    """Upsert the bundled documents and log the outcome for each file
+
+    Returns the number of files that succeeded and failed.
+    """
+    if not len(bundle):
+        return 0, 0
+
+    documents = bundle.drain()
+    with profiler.track_bundle(len(documents)):
+        results = flowise_upserter.upsert_bundle(documents)
+    return log_results(results)
+
+
+def rebuild_bundles(
+    flowise_upserter: FlowiseUpserter,
+    frontmatter_processor: FrontmatterProcessor,
+    profiler: RunProfiler,
+    bundle: DocumentBundle,
+    stale_bundles: Dict[str, Dict[Path, Tuple[Path, str, Dict]]],
+) -> Tuple[int, int]:
+    """Replace bundle loaders whose documents changed in place
+
+    stale_bundles maps each bundle loader ID to the changed documents that
+    stay in it. The other members still in the bundle are read back from disk
+    so the rebuilt loader holds no stale copy, and a bundle left without any
+    member is deleted. Members no longer fitting within the limits of bundle
+    move to a new bundle. Returns how many of the changed files succeeded and
+    failed.
+    """
+    succeeded = failed = 0
+    for loader_id, updates in stale_bundles.items():
+        documents = []
+        for key, member_path in flowise_upserter.bundle_members(loader_id):
+            if member_path in updates:
+                documents.append(updates[member_path])
+                continue
+            try:
+                content, metadata = read_document(
+                    member_path, frontmatter_processor, profiler
+                )
+            except Exception as e:
+                logging.warning(
+                    f"Dropping {member_path} from bundle loader {loader_id}: {str(e)}"
+                )
+                flowise_upserter.forget_document(key)
+                continue
+            documents.append((member_path, content, metadata))
+
+        # Keep the rebuilt bundle within the limits, the rest goes to a new one
+        rebuilt = DocumentBundle(
+            bundle.max_bytes, bundle.max_documents, bundle.max_document_bytes
+        )
+        overflow = []
+        for document in documents:
+            if rebuilt.fits(document[1], document[2]):
+                rebuilt.add(*document)
+            else:
+                overflow.append(document)
+
+        with profiler.track_bundle(len(documents)):
+            if not len(rebuilt):
+                try:
+                    flowise_upserter.delete_loader(loader_id)
+                except Exception as e:
+                    logging.error(
+                        f"Error deleting empty bundle loader {loader_id}: {str(e)}"
+                    )
+                continue
+            results = flowise_upserter.upsert_bundle(rebuilt.drain(), loader_id)
+            results.update(flowise_upserter.upsert_bundle(overflow))
+
+        changed = log_results(
+            {path: result for path, result in results.items() if path in updates}
+        )
+        succeeded += changed[0]
+        failed += changed[1]
+        for file_path, result in results.items():
+            if file_path not in updates and isinstance(result, Exception):
+                logging.error(
+                    f"Error rebuilding bundle loader {loader_id} with {file_path}: "
+                    f"{str(result)}"
+                )
+    return succeeded, failed
+
+
 def main():
     try:
         # Load and validate environment variables
@@ -61,6 +184,18 @@ def main():
         hours_lookback = int(os.getenv("HOURS_LOOKBACK", "24"))
         exclude_patterns = os.getenv("EXCLUDE_PATTERNS", "*.tmp,~*").split(",")
         max_file_size = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB default
+        profile_enabled = "--profile" in sys.argv or os.getenv(
+            "PROFILE", "false"
+        ).lower() in ("1", "true", "yes")
+        profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+        bundle_enabled = os.getenv("BUNDLE_MODE", "false").lower() in (
+            "1",
+            "true",
+            "yes",
+        )
+        bundle_max_bytes = int(os.getenv("BUNDLE_MAX_BYTES", "262144"))  # 256KB
+        bundle_max_documents = int(os.getenv("BUNDLE_MAX_DOCUMENTS", "100"))
+        bundle_max_document_bytes = int(os.getenv("BUNDLE_MAX_DOCUMENT_BYTES", "4096"))
 
         logging.info(f"Configuration loaded:")
         logging.info(f"Watch directory: {watch_directory}")
@@ -68,7 +203,22 @@ def main():
         logging.info(f"Exclude patterns: {exclude_patterns}")
         logging.info(f"Hours lookback: {hours_lookback}")
         logging.info(f"Max file size: {max_file_size} bytes")
+        if bundle_enabled:
+            logging.info(
+                f"Bundle mode: documents up to {bundle_max_document_bytes} bytes, "
+                f"up to {bundle_max_documents} documents and {bundle_max_bytes} "
+                f"encoded bytes per request"
+            )
+
+        profiler = RunProfiler(
+            enabled=profile_enabled,
+            sample_rate=profile_sample_rate,
+            report_file=os.getenv("PROFILE_REPORT_FILE", "profile_report.txt"),
+            top_n=int(os.getenv("PROFILE_TOP_N", "20")),
+        )
+        profiler.start()
 
+        flowise_upserter = None
         try:
             # Initialize components
             document_finder = DocumentFinder(
@@ -79,43 +229,122 @@ def main():
             )
             frontmatter_processor = FrontmatterProcessor()
             flowise_upserter = FlowiseUpserter()
-
-            # Get recent files
-            recent_files = document_finder.get_recent_files(hours_lookback)
-            logging.info(
-                f"Found {len(recent_files)} files modified in the last {hours_lookback} hours"
+            bundle = DocumentBundle(
+                bundle_max_bytes, bundle_max_documents, bundle_max_document_bytes
             )
 
-            # Process each file
-            for file_path in recent_files:
+            # Process files as they are discovered
+            found_count = succeeded_count = failed_count = unchanged_count = 0
+            stale_bundles: Dict[str, Dict[Path, Tuple[Path, str, Dict]]] = {}
+            for file_path in document_finder.iter_recent_files(hours_lookback):
+                found_count += 1
                 try:
-                    # Read file content
-                    content = file_path.read_text(encoding="utf-8")
-                    logging.debug(f"Processing file: {file_path}")
+                    bundled = rebundled = False
+                    with profiler.track_file(file_path):
+                        clean_content, processed_metadata = read_document(
+                            file_path, frontmatter_processor, profiler
+                        )
 
-                    # Extract and process frontmatter
-                    metadata, clean_content = frontmatter_processor.extract_frontmatter(
-                        content
-                    )
-                    processed_metadata = frontmatter_processor.process_metadata(
-                        metadata, file_path
-                    )
+                        # Skip documents already in the store with this content
+                        if flowise_upserter.is_unchanged(
+                            file_path, clean_content, processed_metadata
+                        ):
+                            logging.debug(f"Skipping unchanged file: {file_path}")
+                            unchanged_count += 1
+                            continue
+
+                        small = bundle_enabled and bundle.can_bundle(
+                            clean_content, processed_metadata
+                        )
+                        entry = flowise_upserter.get_loader_entry(
+                            file_path, processed_metadata
+                        )
+
+                        # A changed bundled document makes its bundle stale, a
+                        # small one stays in it when the bundle is rebuilt
+                        rebundled = bool(entry and entry.get("bundled"))
+                        if rebundled:
+                            updates = stale_bundles.setdefault(entry["loader_id"], {})
+                            if small:
+                                updates[file_path.absolute()] = (
+                                    file_path,
+                                    clean_content,
+                                    processed_metadata,
+                                )
+                            rebundled = small
+
+                        # Queue small documents never upserted before for a bundle
+                        bundled = small and entry is None
+
+                        # Upsert document
+                        if not bundled and not rebundled:
+                            with profiler.stage("upsert"):
+                                result = flowise_upserter.upsert_document(
+                                    file_path, clean_content, processed_metadata
+                                )
+
+                    # Counted when its bundle is rebuilt after the scan
+                    if rebundled:
+                        logging.debug(f"Queued file for bundle rebuild: {file_path}")
+                        continue
+
+                    # Bundle flushes are profiled on their own, not as this file
+                    if bundled:
+                        if not bundle.fits(clean_content, processed_metadata):
+                            succeeded, failed = flush_bundle(
+                                flowise_upserter, bundle, profiler
+                            )
+                            succeeded_count += succeeded
+                            failed_count += failed
+                        bundle.add(file_path, clean_content, processed_metadata)
+                        logging.debug(f"Bundled file: {file_path}")
+                        continue
 
-                    # Upsert document
-                    result = flowise_upserter.upsert_document(
-                        file_path, clean_content, processed_metadata
-                    )
                     logging.info(f"Successfully processed {file_path}")
                     logging.debug(f"Upsert result: {result}")
+                    succeeded_count += 1
 
                 except Exception as e:
                     logging.error(f"Error processing {file_path}: {str(e)}")
+                    failed_count += 1
                     continue
 
+            # Upsert the remaining bundled documents
+            succeeded, failed = flush_bundle(flowise_upserter, bundle, profiler)
+            succeeded_count += succeeded
+            failed_count += failed
+
+            # Rebuild bundles whose documents changed so they hold no stale copy
+            succeeded, failed = rebuild_bundles(
+                flowise_upserter,
+                frontmatter_processor,
+                profiler,
+                bundle,
+                stale_bundles,
+            )
+            succeeded_count += succeeded
+            failed_count += failed
+
+            logging.info(
+                f"Found {found_count} files modified in the last {hours_lookback} hours: "
+                f"{succeeded_count} processed, {unchanged_count} unchanged, "
+                f"{failed_count} failed"
+            )
+
         except Exception as e:
             logging.error(f"Error in document processing: {str(e)}")
             raise
 
+        finally:
+            # Keep the loader IDs learned so far even if the run was interrupted
+            try:
+                if flowise_upserter is not None:
+                    flowise_upserter.save_loader_ids()
+            except OSError as e:
+                logging.error(f"Could not save loader ID cache: {str(e)}")
+            finally:
+                profiler.stop()
+
     except Exception as e:
         logging.error(f"Critical error in main process: {str(e)}")
         sys.exit(1)
@@ -0,0 +1,216 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class RunProfiler:
+    """Collects per-file CPU time and peak memory for a processing run"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        sample_rate: float = 0.0,
+        report_file: str = "profile_report.txt",
+        top_n: int = 20,
+    ):
+        """
+        Args:
+            enabled: Always profile this run
+            sample_rate: Share of runs (0.0 - 1.0) profiled when not enabled
+            report_file: Base name of the ranked report, each run appends its
+                         timestamp and process ID so sampled runs keep their report
+            top_n: Number of entries kept in each ranking
+        """
+        self.enabled = enabled or (sample_rate > 0 and random.random() < sample_rate)
+        report_path = Path(report_file)
+        run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        self.report_file = report_path.with_name(
+            f"{report_path.stem}_{run_id}{report_path.suffix}"
+        )
+        self.top_n = top_n
+
+        self.file_stats: Dict[Path, Dict] = {}
+        self.bundle_stats: List[Dict] = []
+        self._current: Optional[Dict] = None
+        self._profiler: Optional[cProfile.Profile] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_at = 0.0
+
+        if self.enabled:
+            logging.info(
+                f"Profiling enabled, report will be written to {self.report_file}"
+            )
+
+    def start(self):
+        """Start CPU and memory tracing for the run"""
+        if not self.enabled:
+            return
+        self._started_at = time.perf_counter()
+        tracemalloc.start()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def stop(self):
+        """Stop tracing and write the report"""
+        if not self.enabled or self._profiler is None:
+            return
+        self._profiler.disable()
+        self._snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ]
+        )
+        tracemalloc.stop()
+        self.write_report()
+
+    @contextmanager
+    def track_file(self, file_path: Path):
+        """Measure wall time, CPU time and peak traced memory for a file"""
+        if not self.enabled:
+            yield
+            return
+
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        stats = {"duration": 0.0, "cpu": 0.0, "peak_memory": 0, "stages": {}}
+        self._current = stats
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            stats["duration"] = time.perf_counter() - start
+            stats["cpu"] = time.process_time() - cpu_start
+            _, peak = tracemalloc.get_traced_memory()
+            stats["peak_memory"] = max(peak - baseline, 0)
+            self.file_stats[file_path] = stats
+            self._current = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure wall and CPU time of a processing stage for the current file"""
+        if not self.enabled or self._current is None:
+            yield
+            return
+
+        stage = self._current["stages"].setdefault(name, {"duration": 0.0, "cpu": 0.0})
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            stage["duration"] += time.perf_counter() - start
+            stage["cpu"] += time.process_time() - cpu_start
+
+    @contextmanager
+    def track_bundle(self, document_count: int):
+        """Measure wall time, CPU time and peak traced memory of a bundled upsert"""
+        if not self.enabled:
+            yield
+            return
+
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            self.bundle_stats.append(
+                {
+                    "documents": document_count,
+                    "duration": time.perf_counter() - start,
+                    "cpu": time.process_time() - cpu_start,
+                    "peak_memory": max(peak - baseline, 0),
+                }
+            )
+
+    def _format_bundle_ranking(self) -> List[str]:
+        """Format the slowest bundled upserts"""
+        ranked = sorted(
+            self.bundle_stats, key=lambda stats: stats["duration"], reverse=True
+        )[: self.top_n]
+
+        lines = ["Slowest bundle upserts:"]
+        for stats in ranked:
+            lines.append(
+                f"  {self._format_stats(stats)}  bundle of {stats['documents']} documents"
+            )
+        return lines
+
+    def _format_file_ranking(self, key: str, title: str) -> List[str]:
+        """Format the top files ordered by the given stat"""
+        ranked = sorted(
+            self.file_stats.items(), key=lambda item: item[1][key], reverse=True
+        )[: self.top_n]
+
+        lines = [title]
+        for file_path, stats in ranked:
+            stages = ", ".join(
+                f"{name}={stage['duration']:.3f}s/{stage['cpu']:.3f}s cpu"
+                for name, stage in stats["stages"].items()
+            )
+            lines.append(f"  {self._format_stats(stats)}  {file_path}  [{stages}]")
+        return lines
+
+    @staticmethod
+    def _format_stats(stats: Dict) -> str:
+        """Format wall time, CPU time and peak memory of an entry"""
+        return (
+            f"{stats['duration']:8.3f}s  {stats['cpu']:8.3f}s cpu  "
+            f"{stats['peak_memory'] / 1024:10.1f} KiB"
+        )
+
+    def _format_allocation_ranking(self) -> List[str]:
+        """Format the source lines holding the most traced memory"""
+        lines = ["Largest memory allocations at end of run (by line):"]
+        if self._snapshot is None:
+            return lines
+        for stat in self._snapshot.statistics("lineno")[: self.top_n]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"  {stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  "
+                f"{frame.filename}:{frame.lineno}"
+            )
+        return lines
+
+    def write_report(self):
+        """Write the ranked files and functions report"""
+        total = time.perf_counter() - self._started_at
+
+        lines = [
+            f"Profiled run: {len(self.file_stats)} files, "
+            f"{len(self.bundle_stats)} bundles in {total:.3f}s",
+            "",
+        ]
+        lines += self._format_file_ranking("duration", "Slowest files:")
+        lines.append("")
+        lines += self._format_file_ranking("cpu", "Most CPU-hungry files:")
+        lines.append("")
+        lines += self._format_file_ranking("peak_memory", "Most memory-hungry files:")
+        lines.append("")
+        if self.bundle_stats:
+            lines += self._format_bundle_ranking()
+            lines.append("")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+        lines.append("Hottest functions (cumulative time):")
+        lines.append(stream.getvalue())
+        lines += self._format_allocation_ranking()
+        lines.append("")
+
+        self.report_file.write_text("\n".join(lines), encoding="utf-8")
+        logging.info(f"Profile report written to {self.report_file}")
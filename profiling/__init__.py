@@ -0,0 +1,5 @@
+# profiling/__init__.py
+
+from .RunProfiler import RunProfiler
+
+__all__ = ["RunProfiler"]
@@ -1,6 +1,6 @@
 from pathlib import Path
 import time
-from typing import List, Optional
+from typing import Iterator, List, Optional
 import logging
 
 
@@ -43,25 +43,30 @@ class DocumentFinder:
 
         return True
 
-    def get_recent_files(self, hours: int = 24) -> List[Path]:
-        """Get files modified within the specified hours"""
+    def iter_recent_files(self, hours: int = 24) -> Iterator[Path]:
+        """Yield files modified within the specified hours as they are found"""
         cutoff_time = time.time() - (hours * 3600)
-        recent_files = []
+        found = 0
 
         for pattern in self.file_patterns:
             for file_path in self.watch_directory.rglob(pattern):
                 try:
-                    if (
+                    if not (
                         file_path.is_file()
                         and file_path.stat().st_mtime > cutoff_time
                         and self.should_process_file(file_path)
                     ):
-
-                        recent_files.append(file_path)
-                        logging.debug(f"Found recent file: {file_path}")
+                        continue
                 except Exception as e:
                     logging.error(f"Error accessing file {file_path}: {str(e)}")
                     continue
 
-        logging.info(f"Found {len(recent_files)} recent files")
-        return recent_files
+                found += 1
+                logging.debug(f"Found recent file: {file_path}")
+                yield file_path
+
+        logging.info(f"Found {found} recent files")
+
+    def get_recent_files(self, hours: int = 24) -> List[Path]:
+        """Get files modified within the specified hours"""
+        return list(self.iter_recent_files(hours))